@@ -24,12 +24,28 @@ class ClubScoreManager:
         if not club:
             return
         
-        scores = {
+        self.db.club_scores.update_one(
+            {'club_id': club_id},
+            {
+                '$set': {
+                    'scores': self.score_club(club),
+                    'last_updated': datetime.utcnow()
+                }
+            },
+            upsert=True
+        )
+
+    def score_club(self, club: Dict[str, Any]) -> Dict[str, int]:
+        """Calculate the fit of a single club for every list type"""
+        return {
             list_type: self.scorer.calculate_fit(club, list_type)
             for list_type in self.scorer.list_types.keys()
         }
-        
-        self.db.club_scores.update_one(
+
+    @staticmethod
+    def score_update(club_id: Any, scores: Dict[str, int]) -> UpdateOne:
+        """Build the upsert that stores a club's scores in club_scores"""
+        return UpdateOne(
             {'club_id': club_id},
             {
                 '$set': {
@@ -67,21 +83,7 @@ class ClubScoreManager:
         
         operations = []
         for club in clubs_needing_updates:
-            scores = {
-                list_type: self.scorer.calculate_fit(club, list_type)
-                for list_type in self.scorer.list_types.keys()
-            }
-            
-            operations.append(UpdateOne(
-                {'club_id': club['_id']},
-                {
-                    '$set': {
-                        'scores': scores,
-                        'last_updated': datetime.utcnow()
-                    }
-                },
-                upsert=True
-            ))
+            operations.append(self.score_update(club['_id'], self.score_club(club)))
         
         if operations:
             self.db.club_scores.bulk_write(operations)
@@ -0,0 +1,332 @@
+import heapq
+import threading
+import time
+from datetime import datetime
+from math import radians, sin, cos, sqrt, atan2, floor
+from typing import Any, Dict, List, Optional, Tuple
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE_LAT = 111.32
+
+# Hotness weights, shared by the precomputed and per-request parts of the score
+REVIEW_COUNT_WEIGHT = 0.25
+RATING_WEIGHT = 0.5
+RECENCY_WEIGHT = 0.1
+DISTANCE_WEIGHT = 0.15
+
+
+def calculate_distance(lat1, lng1, lat2, lng2):
+    """
+    Calculate the Haversine distance between two points on earth.
+    Returns distance in kilometers.
+    """
+    lat1, lng1, lat2, lng2 = map(radians, [lat1, lng1, lat2, lng2])
+
+    dlat = lat2 - lat1
+    dlng = lng2 - lng1
+
+    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlng/2)**2
+    c = 2 * atan2(sqrt(a), sqrt(1-a))
+
+    return EARTH_RADIUS_KM * c
+
+
+class GeoIndex:
+    """
+    In-memory index of clubs bucketed into fixed-size lat/lng grid cells.
+
+    Each club stores the distance-independent part of its hotness score
+    (review count, rating, review recency). Cells keep their clubs sorted by
+    that base score, so a query only visits the cells its radius covers and
+    stops once no remaining candidate can beat the current top `limit`.
+
+    start() builds the index once and then refreshes it from a background
+    thread, so requests never wait on the database. Each refresh pulls only
+    clubs and reviews changed since the last one; a full rebuild runs every
+    `full_rebuild_interval` seconds to pick up deletions. Refreshes build new
+    dicts and swap them in, so readers always see a consistent snapshot.
+
+    The recency term is fixed when a club's entry is built, so for clubs that
+    have not changed it can lag by up to `full_rebuild_interval`. With recency
+    weighted at 0.1 that shifts a score by less than 0.005 per hour.
+    """
+
+    def __init__(self, db, cell_size_km: float = 5.0, refresh_interval: float = 60,
+                 full_rebuild_interval: float = 3600):
+        self.db = db
+        self.cell_deg = cell_size_km / KM_PER_DEGREE_LAT
+        self.refresh_interval = refresh_interval
+        self.full_rebuild_interval = full_rebuild_interval
+
+        # Serializes refreshes; readers never take it
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Serializes start(), so the index is built and its thread started only once
+        self._start_lock = threading.Lock()
+
+        self._clubs: Dict[str, Dict[str, Any]] = {}
+        # (review count, last review date) per club id, including clubs not in the index
+        self._review_stats: Dict[str, Tuple[int, Optional[datetime]]] = {}
+        self._cells: Dict[Tuple[int, int], List[Dict[str, Any]]] = {}
+        self._club_watermark: Optional[datetime] = None
+        self._review_watermark: Optional[datetime] = None
+        self._last_refresh: Optional[float] = None
+        self._last_full_rebuild: Optional[float] = None
+
+    def cell_for(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (floor(lat / self.cell_deg), floor(lng / self.cell_deg))
+
+    def cells_within(self, lat: float, lng: float, radius_km: float) -> List[Tuple[int, int]]:
+        """All cells intersecting the bounding box of a radius around (lat, lng)."""
+        dlat = radius_km / KM_PER_DEGREE_LAT
+        max_abs_lat = min(abs(lat) + dlat, 89.0)
+        dlng = radius_km / (KM_PER_DEGREE_LAT * cos(radians(max_abs_lat)))
+
+        row_min, col_min = self.cell_for(lat - dlat, lng - dlng)
+        row_max, col_max = self.cell_for(lat + dlat, lng + dlng)
+
+        return [
+            (row, col)
+            for row in range(row_min, row_max + 1)
+            for col in range(col_min, col_max + 1)
+        ]
+
+    def start(self) -> None:
+        """Build the index now, then keep it fresh from a daemon thread. Later calls do nothing."""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+
+            try:
+                self.refresh()
+            except Exception as e:
+                # The background thread retries; until then queries return no clubs
+                print(f"Error building geo index: {str(e)}")
+
+            self._thread = threading.Thread(target=self._refresh_loop, name='geo-index-refresh', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _refresh_loop(self) -> None:
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing geo index: {str(e)}")
+
+    def refresh(self, full: bool = False) -> None:
+        """Apply changes since the last refresh, or rebuild everything if a full rebuild is due."""
+        with self._lock:
+            rebuild_due = (
+                self._last_full_rebuild is None or
+                time.monotonic() - self._last_full_rebuild >= self.full_rebuild_interval
+            )
+            if full or rebuild_due:
+                self._full_rebuild()
+            else:
+                self._incremental_refresh()
+            self._last_refresh = time.monotonic()
+
+    def _full_rebuild(self) -> None:
+        review_stats = {}
+        review_watermark = None
+        for row in self.db.reviews.aggregate([
+            {'$group': {'_id': '$club', 'count': {'$sum': 1}, 'last': {'$max': '$createdAt'}}}
+        ]):
+            review_stats[str(row['_id'])] = (row['count'], row['last'])
+            if row['last'] and (review_watermark is None or row['last'] > review_watermark):
+                review_watermark = row['last']
+
+        clubs = {}
+        club_watermark = None
+        for club in self.db.clubusers.find({}, self._club_projection()):
+            entry = self._make_entry(club, review_stats)
+            if entry is not None:
+                clubs[entry['_id']] = entry
+            updated = club.get('updatedAt')
+            if updated and (club_watermark is None or updated > club_watermark):
+                club_watermark = updated
+
+        cells: Dict[Tuple[int, int], List[Dict[str, Any]]] = {}
+        for entry in clubs.values():
+            cells.setdefault(entry['cell'], []).append(entry)
+        for members in cells.values():
+            members.sort(key=lambda e: e['base_score'], reverse=True)
+
+        self._clubs = clubs
+        self._cells = cells
+        self._review_stats = review_stats
+        self._club_watermark = club_watermark
+        self._review_watermark = review_watermark
+        self._last_full_rebuild = time.monotonic()
+
+    def _incremental_refresh(self) -> None:
+        # Read both cursors completely before touching any state, so a failed
+        # refresh leaves the index and its watermarks exactly as they were
+        club_query = {'updatedAt': {'$gt': self._club_watermark}} if self._club_watermark else {}
+        updated_clubs = list(self.db.clubusers.find(club_query, self._club_projection()))
+        review_query = {'createdAt': {'$gt': self._review_watermark}} if self._review_watermark else {}
+        new_reviews = list(self.db.reviews.find(review_query, {'club': 1, 'createdAt': 1}))
+
+        changed: Dict[str, Dict[str, Any]] = {}
+        removed = set()
+        club_watermark = self._club_watermark
+        review_watermark = self._review_watermark
+
+        # Count every new review, whether or not its club is currently indexed
+        review_stats = dict(self._review_stats)
+        reviewed = set()
+        for review in new_reviews:
+            created = review.get('createdAt')
+            if created and (review_watermark is None or created > review_watermark):
+                review_watermark = created
+            club_id = str(review.get('club'))
+            count, last = review_stats.get(club_id, (0, None))
+            if created and (last is None or created > last):
+                last = created
+            review_stats[club_id] = (count + 1, last)
+            reviewed.add(club_id)
+
+        for club in updated_clubs:
+            club_id = str(club['_id'])
+            entry = self._make_entry(club, review_stats)
+            if entry is not None:
+                changed[club_id] = entry
+                removed.discard(club_id)
+            elif club_id in self._clubs:
+                removed.add(club_id)
+            updated = club.get('updatedAt')
+            if updated and (club_watermark is None or updated > club_watermark):
+                club_watermark = updated
+
+        for club_id in reviewed:
+            previous = self._clubs.get(club_id)
+            if club_id in changed or club_id in removed or previous is None:
+                continue
+            changed[club_id] = self._rescore(previous, *review_stats[club_id])
+
+        clubs = dict(self._clubs)
+        cells = dict(self._cells)
+
+        touched_cells = set()
+        for club_id in removed:
+            touched_cells.add(clubs.pop(club_id)['cell'])
+        for club_id, entry in changed.items():
+            previous = clubs.get(club_id)
+            if previous is not None:
+                touched_cells.add(previous['cell'])
+            touched_cells.add(entry['cell'])
+            clubs[club_id] = entry
+
+        # Rebuild only the affected cells
+        for cell in touched_cells:
+            members = [e for e in cells.get(cell, []) if e['_id'] not in changed and e['_id'] not in removed]
+            members.extend(e for e in changed.values() if e['cell'] == cell)
+            members.sort(key=lambda e: e['base_score'], reverse=True)
+            if members:
+                cells[cell] = members
+            else:
+                cells.pop(cell, None)
+
+        self._clubs = clubs
+        self._cells = cells
+        self._review_stats = review_stats
+        self._club_watermark = club_watermark
+        self._review_watermark = review_watermark
+
+    def _club_projection(self) -> Dict[str, int]:
+        return {'displayName': 1, 'username': 1, 'location': 1, 'rating': 1, 'updatedAt': 1}
+
+    def _make_entry(self, club: Dict[str, Any],
+                    review_stats: Dict[str, Tuple[int, Optional[datetime]]]) -> Optional[Dict[str, Any]]:
+        try:
+            lng, lat = club['location']['coordinates'][:2]
+            lat, lng = float(lat), float(lng)
+        except (KeyError, TypeError, ValueError):
+            # Clubs without valid coordinates can never be within range
+            return None
+
+        entry = {
+            '_id': str(club['_id']),
+            'displayName': club.get('displayName'),
+            'username': club.get('username'),
+            'rating': float(club.get('rating') or 0),
+            'lat': lat,
+            'lng': lng,
+            'cell': self.cell_for(lat, lng)
+        }
+        return self._rescore(entry, *review_stats.get(entry['_id'], (0, None)))
+
+    def _rescore(self, entry: Dict[str, Any], review_count: int,
+                 last_review_date: Optional[datetime]) -> Dict[str, Any]:
+        """Return a copy of `entry` with updated review stats and base score."""
+        if last_review_date is None:
+            # Clubs without reviews are treated as reviewed just now
+            recency_score = 1.0
+        else:
+            days_since_last_review = max((datetime.utcnow() - last_review_date).total_seconds(), 0) / (24 * 60 * 60)
+            recency_score = 1 / (days_since_last_review + 1)
+
+        return {
+            **entry,
+            'review_count': review_count,
+            'last_review_date': last_review_date,
+            'base_score': (
+                review_count * REVIEW_COUNT_WEIGHT +
+                entry['rating'] * RATING_WEIGHT +
+                recency_score * RECENCY_WEIGHT
+            )
+        }
+
+    def query(self, user_location: Dict[str, float], limit: int = 100, max_distance: float = 10) -> List[Dict[str, Any]]:
+        """Top `limit` clubs within `max_distance` km, ranked by base score plus the distance term."""
+        user_lat = float(user_location['lat'])
+        user_lng = float(user_location['lng'])
+
+        index = self._cells
+        cells = [index.get(cell, []) for cell in self.cells_within(user_lat, user_lng, max_distance)]
+
+        # Min-heap of (hotness, tiebreak, record) holding the best `limit` seen so far
+        top: List[Tuple[float, int, Dict[str, Any]]] = []
+        candidates = heapq.merge(*cells, key=lambda e: e['base_score'], reverse=True)
+        for i, entry in enumerate(candidates):
+            # The distance term adds at most DISTANCE_WEIGHT, so nothing further down can make the cut
+            if len(top) >= limit and entry['base_score'] + DISTANCE_WEIGHT <= top[0][0]:
+                break
+
+            distance = calculate_distance(user_lat, user_lng, entry['lat'], entry['lng'])
+            if distance > max_distance:
+                continue
+
+            hotness_score = entry['base_score'] + (1 - distance / max_distance) * DISTANCE_WEIGHT
+            record = {
+                '_id': entry['_id'],
+                'displayName': entry['displayName'],
+                'username': entry['username'],
+                'review_count': entry['review_count'],
+                'rating': entry['rating'],
+                'hotness_score': hotness_score,
+                'distance': distance
+            }
+            if len(top) < limit:
+                heapq.heappush(top, (hotness_score, -i, record))
+            elif hotness_score > top[0][0]:
+                heapq.heapreplace(top, (hotness_score, -i, record))
+
+        return [record for _, _, record in sorted(top, key=lambda t: (t[0], t[1]), reverse=True)]
+
+    def stats(self) -> Dict[str, Any]:
+        clubs, cells = self._clubs, self._cells
+        cell_sizes = [len(members) for members in cells.values()]
+        return {
+            'clubs': len(clubs),
+            'cells': len(cell_sizes),
+            'max_clubs_per_cell': max(cell_sizes, default=0),
+            'seconds_since_refresh': (
+                round(time.monotonic() - self._last_refresh, 1) if self._last_refresh is not None else None
+            )
+        }
@@ -0,0 +1,208 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class OverloadedError(Exception):
+    """Raised when a request is shed and no stale result is available."""
+
+    def __init__(self, endpoint: str, reason: str, retry_after: int = 1):
+        super().__init__(f"{endpoint} overloaded: {reason}")
+        self.endpoint = endpoint
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Call:
+    """A single in-flight computation shared by every caller with the same key."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.stale = False
+
+
+class RequestCoalescer:
+    """
+    Single-flight coalescing plus bounded admission for one endpoint.
+
+    Concurrent calls with the same key share one computation. At most
+    `max_concurrent` computations run at once, on a worker pool; up to
+    `max_queue` more may wait for a slot for at most `queue_timeout` seconds.
+    Every caller, including the one that started the computation, waits at
+    most `queue_timeout + compute_timeout` in total. Anything beyond that is
+    shed: the last good result for the key is served if it is younger than
+    `stale_ttl`, otherwise OverloadedError is raised. A computation that
+    outlives its callers keeps running and fills the cache when it finishes.
+    """
+
+    def __init__(self, endpoint: str, max_concurrent: int = 4, max_queue: int = 32,
+                 queue_timeout: float = 2.0, compute_timeout: float = 10.0, stale_ttl: float = 300,
+                 max_cached: int = 1024):
+        self.endpoint = endpoint
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.compute_timeout = compute_timeout
+        self.stale_ttl = stale_ttl
+        self.max_cached = max_cached
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        # A slot is taken before submitting, so the pool never queues work itself
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix=f'{endpoint}-compute')
+        self._in_flight: Dict[Hashable, _Call] = {}
+        self._cache: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+        self._queued = 0
+        self._waiting = 0
+        self._running = 0
+        self._stats = {
+            'requests': 0,
+            'coalesced': 0,
+            'computed': 0,
+            'errors': 0,
+            'shed_queue_full': 0,
+            'shed_timeout': 0,
+            'shed_compute_timeout': 0,
+            'shed_follower_timeout': 0,
+            'served_stale': 0
+        }
+
+    def run(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Return (result, is_stale) for `key`, computing it with `fn` unless an
+        identical request is already in flight.
+        """
+        deadline = time.monotonic() + self.queue_timeout + self.compute_timeout
+
+        with self._lock:
+            self._stats['requests'] += 1
+            call = self._in_flight.get(key)
+            if call is not None:
+                self._stats['coalesced'] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._in_flight[key] = call
+                leader = True
+
+        if not leader:
+            with self._lock:
+                self._waiting += 1
+            try:
+                return self._wait(key, call, deadline, 'shed_follower_timeout')
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+
+        try:
+            shed = self._admit(key)
+        except BaseException as e:
+            self._finish(key, call, error=e)
+            raise
+        if shed is not None:
+            self._finish(key, call, result=shed)
+            return shed
+
+        self._executor.submit(self._compute, key, call, fn)
+        return self._wait(key, call, deadline, 'shed_compute_timeout')
+
+    def _wait(self, key: Hashable, call: _Call, deadline: float, timeout_stat: str) -> Tuple[Any, bool]:
+        """Wait for the shared computation until `deadline`, then shed."""
+        if not call.done.wait(max(deadline - time.monotonic(), 0)):
+            with self._lock:
+                self._stats[timeout_stat] += 1
+            return self._shed(key, 'latency budget exceeded')
+        if call.error is not None:
+            raise call.error
+        return call.result, call.stale
+
+    def _admit(self, key: Hashable) -> Optional[Tuple[Any, bool]]:
+        """Take a computation slot. Returns None once admitted, or the stale result served instead."""
+        if self._slots.acquire(blocking=False):
+            return None
+
+        with self._lock:
+            queue_full = self._queued >= self.max_queue
+            if queue_full:
+                self._stats['shed_queue_full'] += 1
+            else:
+                self._queued += 1
+        if queue_full:
+            return self._shed(key, 'admission queue full')
+
+        try:
+            admitted = self._slots.acquire(timeout=self.queue_timeout)
+        finally:
+            with self._lock:
+                self._queued -= 1
+        if admitted:
+            return None
+
+        with self._lock:
+            self._stats['shed_timeout'] += 1
+        return self._shed(key, 'latency budget exceeded')
+
+    def _compute(self, key: Hashable, call: _Call, fn: Callable[[], Any]) -> None:
+        """Run `fn` on a worker while holding a slot that _admit took for us."""
+        with self._lock:
+            self._running += 1
+        try:
+            result = fn()
+        except Exception as e:
+            with self._lock:
+                self._stats['errors'] += 1
+            self._finish(key, call, error=e)
+            return
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._slots.release()
+
+        with self._lock:
+            self._stats['computed'] += 1
+            self._cache[key] = (time.monotonic(), result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+
+        self._finish(key, call, result=(result, False))
+
+    def _finish(self, key: Hashable, call: _Call, result: Optional[Tuple[Any, bool]] = None,
+                error: Optional[BaseException] = None) -> None:
+        """Publish the outcome to everyone waiting on `call` and let new requests start a fresh one."""
+        if error is not None:
+            call.error = error
+        else:
+            call.result, call.stale = result
+        with self._lock:
+            if self._in_flight.get(key) is call:
+                del self._in_flight[key]
+        call.done.set()
+
+    def _shed(self, key: Hashable, reason: str) -> Tuple[Any, bool]:
+        """Serve a recent cached result for `key` or raise OverloadedError."""
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and time.monotonic() - cached[0] <= self.stale_ttl:
+                self._stats['served_stale'] += 1
+                return cached[1], True
+        raise OverloadedError(self.endpoint, reason, retry_after=max(1, round(self.queue_timeout)))
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of queue depth, running computations and shed counters."""
+        with self._lock:
+            return {
+                'endpoint': self.endpoint,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'queue_depth': self._queued,
+                'waiting_followers': self._waiting,
+                'running': self._running,
+                'in_flight_keys': len(self._in_flight),
+                **self._stats
+            }
@@ -1,5 +1,6 @@
 from datetime import datetime, timedelta
 import json
+import os
 from flask import Flask, request, jsonify
 from flask_cors import CORS, cross_origin
 from sklearn.decomposition import NMF
@@ -10,7 +11,8 @@ import numpy as np
 import certifi
 from bson import ObjectId
 from ClubScoreManager import ClubScoreManager
-from math import radians, sin, cos, sqrt, atan2
+from RequestCoalescer import RequestCoalescer, OverloadedError
+from GeoIndex import GeoIndex
 
 def enhanced_json_serializer(obj):
     """Enhanced JSON serializer to handle various non-serializable types"""
@@ -26,118 +28,15 @@ def enhanced_json_serializer(obj):
         return obj.to_dict()
     return str(obj)
 
-def calculate_distance(lat1, lng1, lat2, lng2):
-    """
-    Calculate the Haversine distance between two points on earth.
-    Returns distance in kilometers.
-    """
-
-    print("Calculating distance between coordinates: ({}, {}) and ({}, {})".format(lat1, lng1, lat2, lng2))
-
-    R = 6371  # Earth's radius in kilometers
-
-    lat1, lng1, lat2, lng2 = map(radians, [lat1, lng1, lat2, lng2])
-    
-    dlat = lat2 - lat1
-    dlng = lng2 - lng1
-    
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlng/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
-    distance = R * c
-    
-    return distance
-
-def calculate_hottest(df_clubs, df_reviews, user_location, limit=100, max_distance=10):
+def calculate_hottest(geo_index, user_location, limit=100, max_distance=10):
     try:
-        if df_clubs.empty:
-            print("No clubs found in the database!")
-            return []
+        featured = geo_index.query(user_location, limit=limit, max_distance=max_distance)
 
-        # Create a copy of the dataframe to avoid modifying the original
-        local_clubs = df_clubs.copy()
-        
-        # Calculate distances for all clubs
-        distances = []
-        for _, club in local_clubs.iterrows():
-            try:
-                club_coords = club['location']['coordinates']
-                distance = calculate_distance(
-                    user_location['lat'],
-                    user_location['lng'],
-                    club_coords[1],
-                    club_coords[0]
-                )
-                distances.append(distance)
-            except (KeyError, TypeError):
-                # If club doesn't have valid coordinates, set distance to infinity
-                distances.append(float('inf'))
-        
-        print(distances)
-
-        # Add distances to the dataframe
-        local_clubs['distance'] = distances
-        
-        # Filter clubs within max_distance
-        local_clubs = local_clubs[local_clubs['distance'] <= max_distance]
-        
-        if local_clubs.empty:
+        if not featured:
             print(f"No clubs found within {max_distance}km of the user's location")
             return []
 
-        if df_reviews.empty:
-            print("There are no reviews for any clubs!")
-            result_df = local_clubs[['_id', 'displayName', 'username', 'distance']].head(limit)
-            result_df['review_count'] = 0
-            result_df['rating'] = local_clubs['rating'].fillna(0)
-            result_df['hotness_score'] = 0
-            return json.loads(json.dumps(result_df.to_dict('records'), default=enhanced_json_serializer))
-
-        local_clubs.loc[:, '_id'] = local_clubs['_id'].astype(str)
-        club_ratings = local_clubs[['_id', 'rating']].set_index('_id')
-        club_reviews = pd.merge(local_clubs, df_reviews, left_on='_id', right_on='club', how='left')
-
-        if 'createdAt' not in club_reviews.columns:
-            print("Warning: 'createdAt' column not found. Using current timestamp.")
-            club_reviews['createdAt'] = pd.Timestamp.now()
-
-        club_metrics = club_reviews.groupby('_id_x').agg({
-            'club': 'count',
-            'createdAt': 'max',
-            'displayName': 'first',
-            'username': 'first',
-            'distance': 'first'  # Include distance in aggregation
-        }).reset_index()
-
-        club_metrics.columns = ['_id', 'review_count', 'last_review_date', 'displayName', 'username', 'distance']
-
-        club_metrics = club_metrics.merge(club_ratings, left_on='_id', right_index=True, how='left')
-
-        club_metrics['review_count'] = club_metrics['review_count'].fillna(0)
-        club_metrics['rating'] = club_metrics['rating'].fillna(0)
-        club_metrics['last_review_date'] = club_metrics['last_review_date'].fillna(pd.Timestamp.now())
-
-        now = pd.Timestamp.now()
-        club_metrics['last_review_date'] = pd.to_datetime(club_metrics['last_review_date'], errors='coerce')
-        club_metrics['days_since_last_review'] = (now - club_metrics['last_review_date']).dt.total_seconds() / (24 * 60 * 60)
-        club_metrics['recency_score'] = 1 / (club_metrics['days_since_last_review'] + 1)
-        
-        # Add distance factor to hotness score (closer = better)
-        club_metrics['distance_score'] = 1 - (club_metrics['distance'] / max_distance)
-        
-        club_metrics['hotness_score'] = (
-            club_metrics['review_count'] * 0.25 +
-            club_metrics['rating'] * 0.5 +
-            club_metrics['recency_score'] * 0.1 +
-            club_metrics['distance_score'] * 0.15  # Add distance influence
-        )
-
-        top_clubs = club_metrics.sort_values('hotness_score', ascending=False).head(limit)
-        result_df = top_clubs[['_id', 'displayName', 'username', 'review_count', 'rating', 'hotness_score', 'distance']].copy()
-
-        print("Calculated Results for hottest club: ")
-        print(result_df)
-
-        return json.loads(json.dumps(result_df.to_dict('records'), default=enhanced_json_serializer))
+        return json.loads(json.dumps(featured, default=enhanced_json_serializer))
     except Exception as e:
         print(f"Error in calculate_hottest: {str(e)}")
         raise
@@ -185,6 +84,15 @@ def get_mongo_data():
 
     return df_reviews, df_clubs, df_users
 
+def quantize_location(location, precision=3):
+    """Round coordinates so nearby users (~100m at precision 3) share a cache/coalescing key."""
+    return (round(float(location['lat']), precision), round(float(location['lng']), precision))
+
+def overloaded_response(error):
+    response = jsonify({'error': str(error)})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
 def get_specific_club_data(club_id):
     club = PlinkoDB['clubusers'].find_one({'_id': ObjectId(club_id)})
     return club
@@ -199,6 +107,11 @@ app = Flask(__name__)
 cors = CORS(app)
 app.config['CORS_HEADERS'] = 'Content-Type'
 
+geo_index = GeoIndex(PlinkoDB)
+
+featured_clubs_gate = RequestCoalescer('featured-clubs', max_concurrent=4, max_queue=32, queue_timeout=2.0)
+recommendations_gate = RequestCoalescer('recommendations', max_concurrent=2, max_queue=16, queue_timeout=3.0)
+
 @app.route('/featured-clubs', methods=["POST"])
 @cross_origin()
 def get_featured_clubs():
@@ -207,14 +120,18 @@ def get_featured_clubs():
         if not location or 'lat' not in location or 'lng' not in location:
             return jsonify({'error': 'Location coordinates (lat, lng) are required.'}), 400
         
-        df_reviews, df_clubs, _ = get_mongo_data()
-        
-        #print("Reviews columns:", df_reviews.columns.tolist())
-        #print("Clubs columns:", df_clubs.columns.tolist())
-        
-        featured_clubs = calculate_hottest(df_clubs, df_reviews, location)
+        lat, lng = quantize_location(location)
+        # Normally already started from __main__; this covers WSGI servers
+        geo_index.start()
+
+        def compute():
+            return calculate_hottest(geo_index, {'lat': lat, 'lng': lng})
 
-        return jsonify({'featuredClubs': featured_clubs}), 200
+        featured_clubs, stale = featured_clubs_gate.run((lat, lng), compute)
+
+        return jsonify({'featuredClubs': featured_clubs, 'stale': stale}), 200
+    except OverloadedError as e:
+        return overloaded_response(e)
     except Exception as e:
         print(f"Error in get_featured_clubs: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -254,26 +171,46 @@ def get_clubs(category: str):  # Remove async
 def get_recommendations():
     try:
         user_id = request.json.get('user_id')
-        df_reviews, df_clubs, df_users = get_mongo_data()
-        recommendations = collaborative_filtering(df_reviews)
-
-        ids = recommendations[user_id]
-        displayRecs = []
-        print('!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!Here are the reccomendations i got: ')
-        print(recommendations)
-        for id in ids:
-            for i in range(len(df_clubs['_id'])):
-                if str(df_clubs['_id'][i]) == str(id):
-                    displayRecs.append(str(df_clubs['username'][i]))
-
-        for i in range(len(df_users['_id'])):
-            if str(df_users['_id'][i]) == str(user_id):
-                username = df_users['username'][i]
-
-        return jsonify({"recs": displayRecs, "username": username})
+
+        def compute():
+            df_reviews, df_clubs, df_users = get_mongo_data()
+            recommendations = collaborative_filtering(df_reviews)
+
+            ids = recommendations[user_id]
+            displayRecs = []
+            print('!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!Here are the reccomendations i got: ')
+            print(recommendations)
+            for id in ids:
+                for i in range(len(df_clubs['_id'])):
+                    if str(df_clubs['_id'][i]) == str(id):
+                        displayRecs.append(str(df_clubs['username'][i]))
+
+            for i in range(len(df_users['_id'])):
+                if str(df_users['_id'][i]) == str(user_id):
+                    username = df_users['username'][i]
+
+            return {"recs": displayRecs, "username": username}
+
+        recs, stale = recommendations_gate.run(str(user_id), compute)
+
+        return jsonify({**recs, "stale": stale})
+    except OverloadedError as e:
+        return overloaded_response(e)
     except Exception as e:
         print(e)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/load-stats', methods=['GET'])
+def get_load_stats():
+    return jsonify({
+        'featuredClubs': featured_clubs_gate.stats(),
+        'recommendations': recommendations_gate.stats(),
+        'geoIndex': geo_index.stats()
+    })
+
 if __name__ == '__main__':
+    # With the debug reloader this module runs in a watcher process and a serving
+    # process; only build the index in the one that serves requests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        geo_index.start()
     app.run(debug=True)
@@ -0,0 +1,355 @@
+"""
+Offline bulk scoring for the club lists, independent of the Flask app.
+
+Reads clubs from MongoDB or from a JSONL/Parquet export, scores them with
+ClubScoreManager and writes the results back to club_scores in bulk or to a
+JSONL/Parquet file. Work can be split across processes or machines with
+--shard i/n. A club's shard depends only on its own _id (the counter bytes of
+an ObjectId, or a hash of any other id), so every club lands in exactly one
+shard however the collection changes while shards run. For MongoDB the
+filter is evaluated server-side.
+
+File outputs are written to a temporary path and renamed into place only
+when the run succeeds, so an aborted run never leaves a partial file behind.
+
+Examples:
+    python score_clubs.py --shard 0/4
+    python score_clubs.py --source clubs.jsonl --output scores.parquet
+
+Importing this module does not connect to anything.
+"""
+import argparse
+import os
+import sys
+import time
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from ClubScoreManager import ClubScoreManager
+
+DEFAULT_DB_NAME = 'PlinkoDB'
+PROGRESS_EVERY = 10000
+
+# Every club field ClubScorer reads
+CLUB_PROJECTION = {
+    field: 1 for field in [
+        'rating', 'events', 'followers', 'reviews', 'formatted_price', 'dress_code',
+        'features', 'min_age', 'genres', 'capacity', 'table_layout'
+    ]
+}
+
+# Shard ObjectIds on the low 16 bits of their counter, which increments per id generated
+SHARD_HEX_DIGITS = 4
+HEX_DIGITS = '0123456789abcdef'
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Parse an 'i/n' shard spec into (i, n)"""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard must look like i/n, got {value!r}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Shard index must satisfy 0 <= i < n, got {value!r}")
+    return index, count
+
+
+def is_object_id_hex(value: str) -> bool:
+    return len(value) == 24 and all(c in HEX_DIGITS for c in value.lower())
+
+
+def shard_key(club_id: Any) -> int:
+    """Stable shard key: the ObjectId counter's low bits, or a CRC32 of any other id"""
+    text = str(club_id)
+    if is_object_id_hex(text):
+        return int(text[-SHARD_HEX_DIGITS:], 16)
+    return zlib.crc32(text.encode())
+
+
+def in_shard(club_id: Any, shard: Tuple[int, int]) -> bool:
+    index, count = shard
+    return shard_key(club_id) % count == index
+
+
+def shard_query(shard: Tuple[int, int]) -> Dict[str, Any]:
+    """
+    Server-side equivalent of in_shard for ObjectId _ids: rebuild the same
+    counter bits from the id's hex string and compare them modulo n.
+    """
+    index, count = shard
+    if count == 1:
+        return {}
+
+    hex_id = {'$toLower': {'$toString': '$_id'}}
+    digits = [
+        {'$multiply': [
+            {'$indexOfBytes': [HEX_DIGITS, {'$substrBytes': [hex_id, 24 - SHARD_HEX_DIGITS + position, 1]}]},
+            16 ** (SHARD_HEX_DIGITS - 1 - position)
+        ]}
+        for position in range(SHARD_HEX_DIGITS)
+    ]
+    return {'$expr': {'$eq': [{'$mod': [{'$add': digits}, count]}, index]}}
+
+
+def to_object_id(club_id: Any) -> Any:
+    """Turn 24-hex string ids from exports back into ObjectIds so they match clubusers._id"""
+    from bson import ObjectId
+
+    if isinstance(club_id, str) and ObjectId.is_valid(club_id):
+        return ObjectId(club_id)
+    return club_id
+
+
+def from_parquet(value: Any) -> Any:
+    """Convert pandas/numpy values into the plain lists, dicts and scalars ClubScorer expects; NA becomes None"""
+    import pandas as pd
+
+    if isinstance(value, dict):
+        return {key: from_parquet(item) for key, item in value.items()}
+    if hasattr(value, 'tolist'):
+        # numpy arrays and numpy scalars
+        value = value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [from_parquet(item) for item in value]
+    if value is not None and not isinstance(value, str) and pd.isna(value):
+        return None
+    return value
+
+
+def connect(mongo_uri: Optional[str], db_name: str):
+    from pymongo import MongoClient
+    import certifi
+
+    if not mongo_uri:
+        raise SystemExit("A MongoDB URI is required: pass --mongo-uri or set MONGO_URI")
+    return MongoClient(mongo_uri, tlsCAFile=certifi.where())[db_name]
+
+
+def read_clubs(source: str, db=None, shard: Tuple[int, int] = (0, 1)) -> Iterator[Dict[str, Any]]:
+    """Yield the club documents in `shard` from MongoDB ('mongo') or a .jsonl/.parquet export"""
+    if source == 'mongo':
+        yield from db.clubusers.find(shard_query(shard), CLUB_PROJECTION, batch_size=1000)
+    elif source.endswith('.jsonl'):
+        from bson import json_util
+
+        with open(source) as f:
+            for line in f:
+                if line.strip():
+                    club = json_util.loads(line)
+                    if in_shard(club.get('_id'), shard):
+                        yield club
+    elif source.endswith('.parquet'):
+        import pandas as pd
+
+        for record in pd.read_parquet(source).to_dict('records'):
+            if not in_shard(record.get('_id'), shard):
+                continue
+            # Drop missing fields entirely so ClubScorer falls back to its defaults
+            club = {key: from_parquet(value) for key, value in record.items()}
+            yield {key: value for key, value in club.items() if value is not None}
+    else:
+        raise SystemExit(f"Unsupported source {source!r}: expected 'mongo', .jsonl or .parquet")
+
+
+class MongoScoreWriter:
+    """Buffers score upserts and flushes them to club_scores with bulk_write"""
+
+    def __init__(self, db, batch_size: int):
+        self.db = db
+        self.batch_size = batch_size
+        self.operations = []
+
+    def write(self, club_id: Any, scores: Dict[str, int]) -> None:
+        self.operations.append(ClubScoreManager.score_update(club_id, scores))
+        if len(self.operations) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.operations:
+            self.db.club_scores.bulk_write(self.operations, ordered=False)
+            self.operations = []
+
+    def close(self) -> None:
+        self.flush()
+
+    def abort(self) -> None:
+        # Every buffered upsert is a valid score, so keep them
+        self.flush()
+
+
+class FileScoreWriter:
+    """Writes to `path + '.partial'` and moves it to `path` only when the run succeeds"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.partial_path = path + '.partial'
+
+    def commit(self) -> None:
+        os.replace(self.partial_path, self.path)
+
+    def discard(self) -> None:
+        if os.path.exists(self.partial_path):
+            os.remove(self.partial_path)
+
+
+class JsonlScoreWriter(FileScoreWriter):
+    """Writes one club_scores-shaped document per line"""
+
+    def __init__(self, path: str):
+        from bson import json_util
+
+        super().__init__(path)
+        self.dumps = json_util.dumps
+        self.file = open(self.partial_path, 'w')
+
+    def write(self, club_id: Any, scores: Dict[str, int]) -> None:
+        self.file.write(self.dumps({
+            'club_id': club_id,
+            'scores': scores,
+            'last_updated': datetime.utcnow()
+        }) + '\n')
+
+    def close(self) -> None:
+        self.file.close()
+        self.commit()
+
+    def abort(self) -> None:
+        self.file.close()
+        self.discard()
+
+
+class ParquetScoreWriter(FileScoreWriter):
+    """
+    Streams scores to Parquet one row group per `batch_size` clubs.
+    Rows have the same shape as JsonlScoreWriter, with club_id stored as a string.
+    """
+
+    def __init__(self, path: str, batch_size: int):
+        super().__init__(path)
+        self.batch_size = batch_size
+        self.rows = []
+        self.writer = None
+
+    def write(self, club_id: Any, scores: Dict[str, int]) -> None:
+        self.rows.append({'club_id': str(club_id), 'scores': scores, 'last_updated': datetime.utcnow()})
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self.rows:
+            return
+        if self.writer is None:
+            table = pa.Table.from_pylist(self.rows)
+            self.writer = pq.ParquetWriter(self.partial_path, table.schema)
+        else:
+            table = pa.Table.from_pylist(self.rows, schema=self.writer.schema)
+        self.writer.write_table(table)
+        self.rows = []
+
+    def close(self) -> None:
+        self.flush()
+        if self.writer is None:
+            # Nothing was scored; still leave a valid, empty file
+            import pandas as pd
+
+            pd.DataFrame(columns=['club_id', 'scores', 'last_updated']).to_parquet(self.partial_path, index=False)
+        else:
+            self.writer.close()
+        self.commit()
+
+    def abort(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.discard()
+
+
+def make_writer(output: str, db=None, batch_size: int = 1000):
+    if output == 'mongo':
+        return MongoScoreWriter(db, batch_size)
+    if output.endswith('.jsonl'):
+        return JsonlScoreWriter(output)
+    if output.endswith('.parquet'):
+        return ParquetScoreWriter(output, batch_size)
+    raise SystemExit(f"Unsupported output {output!r}: expected 'mongo', .jsonl or .parquet")
+
+
+def score_clubs(clubs: Iterable[Dict[str, Any]], writer, log=sys.stderr) -> Dict[str, Any]:
+    """
+    Score every club in `clubs` and hand the results to `writer`. The writer is
+    closed if the run completes and aborted if anything interrupts it.
+    """
+    manager = ClubScoreManager(db=None)
+    stats = {'scored': 0, 'failed': 0}
+    started = time.perf_counter()
+
+    try:
+        for club in clubs:
+            club_id = to_object_id(club.get('_id'))
+            try:
+                scores = manager.score_club(club)
+            except Exception as e:
+                # One malformed document should not abort a backfill
+                stats['failed'] += 1
+                print(f"Failed to score club {club_id}: {str(e)}", file=log)
+                continue
+
+            writer.write(club_id, scores)
+            stats['scored'] += 1
+
+            if stats['scored'] % PROGRESS_EVERY == 0:
+                elapsed = time.perf_counter() - started
+                print(f"Scored {stats['scored']} clubs ({stats['scored'] / elapsed:.0f} clubs/s)", file=log)
+    except BaseException:
+        writer.abort()
+        raise
+
+    writer.close()
+
+    stats['seconds'] = time.perf_counter() - started
+    stats['clubs_per_second'] = stats['scored'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Rescore clubs for every list category.")
+    parser.add_argument('--source', default='mongo',
+                        help="'mongo' (default) or a path to a .jsonl/.parquet club export")
+    parser.add_argument('--output', default='mongo',
+                        help="'mongo' (default, bulk upsert into club_scores) or a .jsonl/.parquet path")
+    parser.add_argument('--mongo-uri', default=os.environ.get('MONGO_URI'),
+                        help="MongoDB connection string (defaults to $MONGO_URI)")
+    parser.add_argument('--db', default=DEFAULT_DB_NAME, help=f"Database name (default {DEFAULT_DB_NAME})")
+    parser.add_argument('--shard', type=parse_shard, default=(0, 1), metavar='i/n',
+                        help="Only score clubs in shard i of n (default 0/1)")
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help="Clubs per bulk_write or Parquet row group (default 1000)")
+    return parser
+
+
+def main(argv=None, db=None) -> int:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    args = build_parser().parse_args(argv)
+
+    if db is None and 'mongo' in (args.source, args.output):
+        db = connect(args.mongo_uri, args.db)
+
+    writer = make_writer(args.output, db=db, batch_size=args.batch_size)
+    stats = score_clubs(read_clubs(args.source, db=db, shard=args.shard), writer)
+
+    index, count = args.shard
+    print(
+        f"Shard {index}/{count}: scored {stats['scored']} clubs, failed {stats['failed']} "
+        f"in {stats['seconds']:.1f}s ({stats['clubs_per_second']:.0f} clubs/s)",
+        file=sys.stderr
+    )
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,234 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from GeoIndex import GeoIndex, calculate_distance, DISTANCE_WEIGHT
+
+ATHENS = {'lat': 37.98, 'lng': 23.72}
+
+
+class FakeCollection:
+    """Just enough of a pymongo collection for GeoIndex: $gt filters and a $group by club."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.fail_next_find = False
+
+    def find(self, query=None, projection=None):
+        if self.fail_next_find:
+            self.fail_next_find = False
+            raise ConnectionError('cursor died')
+        docs = self.docs
+        for field, condition in (query or {}).items():
+            docs = [d for d in docs if d.get(field) is not None and d[field] > condition['$gt']]
+        return iter([dict(d) for d in docs])
+
+    def aggregate(self, pipeline):
+        groups = {}
+        for review in self.docs:
+            count, last = groups.get(review['club'], (0, None))
+            groups[review['club']] = (count + 1, max(last, review['createdAt']) if last else review['createdAt'])
+        return iter([{'_id': club, 'count': count, 'last': last} for club, (count, last) in groups.items()])
+
+
+class FakeDB:
+    def __init__(self, clubs, reviews):
+        self.clubusers = FakeCollection(clubs)
+        self.reviews = FakeCollection(reviews)
+
+
+def make_db(n_clubs=500, n_reviews=1500, seed=1):
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    clubs = [
+        {
+            '_id': i,
+            'displayName': f'club{i}',
+            'username': f'club{i}',
+            'rating': rng.uniform(0, 5),
+            'location': {
+                'type': 'Point',
+                'coordinates': [ATHENS['lng'] + rng.uniform(-0.3, 0.3), ATHENS['lat'] + rng.uniform(-0.3, 0.3)]
+            },
+            'updatedAt': now - timedelta(days=1)
+        }
+        for i in range(n_clubs)
+    ]
+    reviews = [
+        {'club': rng.randrange(n_clubs), 'createdAt': now - timedelta(days=rng.uniform(1, 30))}
+        for _ in range(n_reviews)
+    ]
+    return FakeDB(clubs, reviews)
+
+
+def brute_force(index, location, limit, max_distance):
+    ranked = []
+    for entry in index._clubs.values():
+        distance = calculate_distance(location['lat'], location['lng'], entry['lat'], entry['lng'])
+        if distance <= max_distance:
+            ranked.append((entry['base_score'] + (1 - distance / max_distance) * DISTANCE_WEIGHT, entry['_id']))
+    ranked.sort(key=lambda r: r[0], reverse=True)
+    return [club_id for _, club_id in ranked[:limit]]
+
+
+def touch(club, **fields):
+    club.update(fields, updatedAt=datetime.utcnow())
+
+
+@pytest.mark.parametrize('limit,max_distance', [(1, 10), (20, 10), (100, 5), (1000, 50)])
+def test_query_matches_brute_force_ranking(limit, max_distance):
+    index = GeoIndex(make_db())
+    index.refresh()
+
+    for location in [ATHENS, {'lat': 38.1, 'lng': 23.5}, {'lat': 37.0, 'lng': 22.0}]:
+        result = index.query(location, limit=limit, max_distance=max_distance)
+        assert [r['_id'] for r in result] == brute_force(index, location, limit, max_distance)
+        assert all(r['distance'] <= max_distance for r in result)
+
+
+def test_clubs_without_coordinates_are_skipped():
+    db = make_db(n_clubs=3, n_reviews=0)
+    db.clubusers.docs[0]['location'] = None
+    index = GeoIndex(db)
+    index.refresh()
+
+    assert '0' not in index._clubs
+    assert index.stats()['clubs'] == 2
+
+
+def test_incremental_refresh_applies_club_and_review_changes():
+    db = make_db()
+    index = GeoIndex(db)
+    index.refresh()
+    club = db.clubusers.docs[7]
+    reviews_before = index._clubs['7']['review_count']
+    untouched = {cell: members for cell, members in index._cells.items() if cell != index._clubs['7']['cell']}
+
+    touch(club, rating=5.0)
+    db.reviews.docs.append({'club': 7, 'createdAt': datetime.utcnow()})
+    index.refresh()
+
+    entry = index._clubs['7']
+    assert entry['rating'] == 5.0
+    assert entry['review_count'] == reviews_before + 1
+    assert entry in index._cells[entry['cell']]
+    # Cells the change did not touch are carried over as-is
+    assert all(index._cells[cell] is members for cell, members in untouched.items())
+
+
+def test_incremental_refresh_matches_full_rebuild():
+    db = make_db()
+    index = GeoIndex(db)
+    index.refresh()
+
+    rng = random.Random(2)
+    for club in rng.sample(db.clubusers.docs, 20):
+        touch(club, rating=rng.uniform(0, 5))
+    moved = db.clubusers.docs[3]
+    touch(moved, location={'type': 'Point', 'coordinates': [22.0, 37.0]})
+    touch(db.clubusers.docs[4], location=None)
+    for _ in range(50):
+        db.reviews.docs.append({'club': rng.randrange(len(db.clubusers.docs)), 'createdAt': datetime.utcnow()})
+    index.refresh()
+
+    rebuilt = GeoIndex(db)
+    rebuilt.refresh()
+
+    assert index._clubs.keys() == rebuilt._clubs.keys()
+    assert '4' not in index._clubs
+    assert index._clubs['3']['cell'] == rebuilt._clubs['3']['cell']
+    assert [cell for cell, members in index._cells.items() if any(m['_id'] == '3' for m in members)] == \
+        [index._clubs['3']['cell']]
+    for club_id, entry in rebuilt._clubs.items():
+        assert index._clubs[club_id]['review_count'] == entry['review_count']
+        assert index._clubs[club_id]['rating'] == entry['rating']
+        assert index._clubs[club_id]['base_score'] == pytest.approx(entry['base_score'], abs=1e-3)
+    for location in [ATHENS, {'lat': 37.0, 'lng': 22.0}]:
+        assert [r['_id'] for r in index.query(location, limit=1000)] == \
+            [r['_id'] for r in rebuilt.query(location, limit=1000)]
+
+
+def test_failed_incremental_refresh_loses_no_changes():
+    db = make_db()
+    index = GeoIndex(db)
+    touch(db.clubusers.docs[0], rating=3.0)
+    index.refresh()
+    reviews_before = index._clubs['0']['review_count']
+
+    touch(db.clubusers.docs[0], rating=5.0)
+    db.reviews.docs.append({'club': 0, 'createdAt': datetime.utcnow()})
+    db.reviews.fail_next_find = True
+    with pytest.raises(ConnectionError):
+        index.refresh()
+    assert index._clubs['0']['rating'] == 3.0
+
+    index.refresh()
+    assert index._clubs['0']['rating'] == 5.0
+    assert index._clubs['0']['review_count'] == reviews_before + 1
+
+
+def test_club_that_loses_and_regains_location_keeps_its_reviews():
+    db = make_db(n_clubs=3, n_reviews=0)
+    db.reviews.docs.extend({'club': 1, 'createdAt': datetime.utcnow() - timedelta(days=d)} for d in range(6))
+    index = GeoIndex(db)
+    index.refresh()
+    assert index._clubs['1']['review_count'] == 6
+    location = db.clubusers.docs[1]['location']
+
+    touch(db.clubusers.docs[1], location=None)
+    index.refresh()
+    assert '1' not in index._clubs
+
+    # Reviews written while the club is out of the index still count
+    db.reviews.docs.append({'club': 1, 'createdAt': datetime.utcnow()})
+    index.refresh()
+    touch(db.clubusers.docs[1], location=location)
+    index.refresh()
+
+    entry = index._clubs['1']
+    assert entry['review_count'] == 7
+    rebuilt = GeoIndex(db)
+    rebuilt.refresh()
+    assert entry['base_score'] == pytest.approx(rebuilt._clubs['1']['base_score'], abs=1e-3)
+
+
+def test_full_rebuild_drops_deleted_clubs():
+    db = make_db(n_clubs=10, n_reviews=0)
+    index = GeoIndex(db, full_rebuild_interval=3600)
+    index.refresh()
+    del db.clubusers.docs[5]
+
+    index.refresh()
+    assert '5' in index._clubs
+
+    index.refresh(full=True)
+    assert '5' not in index._clubs
+
+
+def test_start_survives_database_errors():
+    db = make_db(n_clubs=10, n_reviews=0)
+    db.reviews.aggregate = lambda pipeline: (_ for _ in ()).throw(ConnectionError('down'))
+    index = GeoIndex(db, refresh_interval=3600)
+
+    index.start()
+    try:
+        assert index.query(ATHENS) == []
+        assert index.stats()['seconds_since_refresh'] is None
+    finally:
+        index.stop()
+
+
+def test_start_only_builds_once():
+    db = make_db(n_clubs=10, n_reviews=0)
+    index = GeoIndex(db, refresh_interval=3600)
+    builds = []
+    db.reviews.aggregate = lambda pipeline, real=db.reviews.aggregate: builds.append(1) or real(pipeline)
+
+    index.start()
+    index.start()
+    try:
+        assert len(builds) == 1
+        assert index.stats()['clubs'] == 10
+    finally:
+        index.stop()
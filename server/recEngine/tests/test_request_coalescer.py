@@ -0,0 +1,173 @@
+import threading
+import time
+
+from RequestCoalescer import RequestCoalescer, OverloadedError
+
+
+def run_concurrently(gate, keys, fn):
+    """Start one gate.run per key (in order, slightly staggered) and collect results or errors."""
+    results = [None] * len(keys)
+
+    def worker(i, key):
+        try:
+            results[i] = gate.run(key, fn)
+        except OverloadedError as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i, key)) for i, key in enumerate(keys)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def slow(result, delay, calls):
+    def fn():
+        calls.append(result)
+        time.sleep(delay)
+        return result
+    return fn
+
+
+def test_identical_requests_share_one_computation():
+    gate = RequestCoalescer('test', max_concurrent=4)
+    calls = []
+
+    results = run_concurrently(gate, ['a'] * 5, slow(42, 0.3, calls))
+
+    assert results == [(42, False)] * 5
+    assert len(calls) == 1
+    stats = gate.stats()
+    assert stats['coalesced'] == 4
+    assert stats['computed'] == 1
+    assert stats['waiting_followers'] == 0
+
+
+def test_leader_error_propagates_to_followers():
+    gate = RequestCoalescer('test')
+
+    def fail():
+        time.sleep(0.2)
+        raise RuntimeError('boom')
+
+    errors = []
+
+    def worker():
+        try:
+            gate.run('a', fail)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 3
+    assert gate.stats()['errors'] == 1
+
+
+def test_queue_full_and_timeout_are_shed_with_503_error():
+    gate = RequestCoalescer('test', max_concurrent=1, max_queue=1, queue_timeout=0.2)
+    calls = []
+
+    # 'a' takes the only slot, 'b' waits in the queue and times out, 'c' finds the queue full
+    results = run_concurrently(gate, ['a', 'b', 'c'], slow(1, 0.6, calls))
+
+    assert results[0] == (1, False)
+    assert isinstance(results[1], OverloadedError)
+    assert results[1].reason == 'latency budget exceeded'
+    assert isinstance(results[2], OverloadedError)
+    assert results[2].reason == 'admission queue full'
+    stats = gate.stats()
+    assert stats['shed_timeout'] == 1
+    assert stats['shed_queue_full'] == 1
+    assert stats['queue_depth'] == 0
+
+
+def test_shed_request_is_served_stale_result():
+    gate = RequestCoalescer('test', max_concurrent=1, max_queue=0)
+    assert gate.run('b', lambda: 'cached') == ('cached', False)
+
+    calls = []
+    results = run_concurrently(gate, ['a', 'b'], slow('fresh', 0.3, calls))
+
+    assert results[0] == ('fresh', False)
+    assert results[1] == ('cached', True)
+    assert gate.stats()['served_stale'] == 1
+
+
+def test_stale_result_expires():
+    gate = RequestCoalescer('test', max_concurrent=1, max_queue=0, stale_ttl=0)
+    gate.run('b', lambda: 'cached')
+    time.sleep(0.01)
+
+    results = run_concurrently(gate, ['a', 'b'], slow('fresh', 0.3, []))
+
+    assert isinstance(results[1], OverloadedError)
+
+
+def test_followers_are_held_to_the_latency_budget():
+    gate = RequestCoalescer('test', queue_timeout=0.1, compute_timeout=0.1)
+
+    results = run_concurrently(gate, ['a', 'a'], slow('done', 0.5, []))
+
+    assert all(isinstance(result, OverloadedError) for result in results)
+    stats = gate.stats()
+    assert stats['shed_compute_timeout'] == 1
+    assert stats['shed_follower_timeout'] == 1
+    assert stats['waiting_followers'] == 0
+
+
+def test_slow_computation_sheds_leader_and_fills_cache_in_background():
+    gate = RequestCoalescer('test', max_concurrent=1, max_queue=0, queue_timeout=0.05, compute_timeout=0.05)
+    calls = []
+
+    started = time.monotonic()
+    result = run_concurrently(gate, ['a'], slow('late', 0.3, calls))[0]
+    assert isinstance(result, OverloadedError)
+    assert time.monotonic() - started < 0.25
+    assert gate.stats()['shed_compute_timeout'] == 1
+
+    # The computation keeps its slot until it finishes, then caches its result
+    assert isinstance(run_concurrently(gate, ['b'], lambda: 'b')[0], OverloadedError)
+    time.sleep(0.4)
+    assert gate.stats()['computed'] == 1
+    assert gate.stats()['running'] == 0
+
+    # A later shed for the same key is served the background result
+    results = run_concurrently(gate, ['c', 'a'], slow('c', 0.2, calls))
+    assert results[1] == ('late', True)
+    assert calls == ['late', 'c']
+
+
+def test_stats_report_waiting_followers():
+    gate = RequestCoalescer('test')
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocked():
+        started.set()
+        release.wait()
+        return 'ok'
+
+    leader = threading.Thread(target=gate.run, args=('a', blocked))
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=gate.run, args=('a', blocked)) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+
+    deadline = time.monotonic() + 2
+    while gate.stats()['waiting_followers'] < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert gate.stats()['waiting_followers'] == 3
+    assert gate.stats()['running'] == 1
+
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join()
+    assert gate.stats()['waiting_followers'] == 0
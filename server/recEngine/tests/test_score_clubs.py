@@ -0,0 +1,301 @@
+import argparse
+import io
+import math
+import os
+
+import pytest
+
+pytest.importorskip('pymongo')
+from bson import ObjectId, json_util
+
+import score_clubs
+from score_clubs import (
+    CLUB_PROJECTION, JsonlScoreWriter, MongoScoreWriter, ParquetScoreWriter, from_parquet, in_shard,
+    parse_shard, read_clubs, shard_query, to_object_id
+)
+
+
+def evaluate(expr, doc):
+    """Evaluate the handful of aggregation operators shard_query uses."""
+    if isinstance(expr, str) and expr.startswith('$'):
+        return doc[expr[1:]]
+    if isinstance(expr, list):
+        return [evaluate(item, doc) for item in expr]
+    if not isinstance(expr, dict):
+        return expr
+
+    (op, args), = expr.items()
+    args = evaluate(args, doc)
+    if op == '$toString':
+        return str(args)
+    if op == '$toLower':
+        return args.lower()
+    if op == '$substrBytes':
+        text, start, length = args
+        return text[start:start + length]
+    if op == '$indexOfBytes':
+        return args[0].find(args[1])
+    if op == '$multiply':
+        return math.prod(args)
+    if op == '$add':
+        return sum(args)
+    if op == '$mod':
+        return args[0] % args[1]
+    if op == '$eq':
+        return args[0] == args[1]
+    raise NotImplementedError(op)
+
+
+class FakeClubs:
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = []
+
+    def find(self, query=None, projection=None, batch_size=None):
+        self.queries.append((query, projection))
+        docs = self.docs
+        if query and '$expr' in query:
+            docs = [d for d in docs if evaluate(query['$expr'], d)]
+        return iter([dict(d) for d in docs])
+
+
+class FakeScores:
+    def __init__(self):
+        self.batches = []
+
+    def bulk_write(self, operations, ordered=True):
+        self.batches.append(list(operations))
+
+
+class FakeDB:
+    def __init__(self, clubs=()):
+        self.clubusers = FakeClubs(list(clubs))
+        self.club_scores = FakeScores()
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.written = []
+        self.closed = False
+        self.aborted = False
+
+    def write(self, club_id, scores):
+        self.written.append((club_id, scores))
+
+    def close(self):
+        self.closed = True
+
+    def abort(self):
+        self.aborted = True
+
+
+def make_club(**fields):
+    return {'_id': ObjectId(), 'rating': 4, 'features': ['Stage', 'VIP Tables'], **fields}
+
+
+def test_parse_shard():
+    assert parse_shard('0/1') == (0, 1)
+    assert parse_shard('3/4') == (3, 4)
+    for bad in ['4/4', '-1/2', '1/0', '1', 'a/b', '1/2/3']:
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_shard(bad)
+
+
+def test_every_club_lands_in_exactly_one_shard():
+    ids = [ObjectId() for _ in range(300)] + ['plain-id', 42, None]
+    for count in [1, 2, 3, 7]:
+        for club_id in ids:
+            assert sum(in_shard(club_id, (index, count)) for index in range(count)) == 1
+
+
+def test_shard_assignment_is_stable_and_ignores_id_form():
+    oid = ObjectId('5f1d7f3e9b1e8a3d4c2b1a07')
+    # Low 16 bits of the counter: 0x1a07
+    assert [in_shard(oid, (i, 7)) for i in range(7)].index(True) == 0x1a07 % 7
+    for index in range(5):
+        assert in_shard(oid, (index, 5)) == in_shard(str(oid), (index, 5))
+    assert in_shard('plain-id', (1, 3)) == in_shard('plain-id', (1, 3))
+
+
+def test_shard_is_balanced():
+    ids = [ObjectId() for _ in range(4000)]
+    sizes = [sum(in_shard(club_id, (index, 4)) for club_id in ids) for index in range(4)]
+    assert min(sizes) > 900
+
+
+@pytest.mark.parametrize('count', [2, 3, 5])
+def test_server_side_shard_filter_matches_in_shard(count):
+    clubs = [make_club() for _ in range(200)]
+    for index in range(count):
+        db = FakeDB(clubs)
+        expected = [c['_id'] for c in clubs if in_shard(c['_id'], (index, count))]
+        assert [c['_id'] for c in read_clubs('mongo', db=db, shard=(index, count))] == expected
+        assert db.clubusers.queries[0][1] == CLUB_PROJECTION
+
+
+def test_single_shard_has_no_filter():
+    assert shard_query((0, 1)) == {}
+
+
+def test_to_object_id():
+    oid = ObjectId()
+    assert to_object_id(str(oid)) == oid
+    assert to_object_id(oid) is oid
+    assert to_object_id('not-an-id') == 'not-an-id'
+    assert to_object_id(7) == 7
+
+
+def test_jsonl_source_is_sharded(tmp_path):
+    clubs = [make_club() for _ in range(50)]
+    path = tmp_path / 'clubs.jsonl'
+    path.write_text(''.join(json_util.dumps(c) + '\n' for c in clubs) + '\n')
+
+    read = [c['_id'] for i in range(3) for c in read_clubs(str(path), shard=(i, 3))]
+    assert sorted(read) == sorted(c['_id'] for c in clubs)
+
+
+def test_from_parquet_normalizes_numpy_and_missing_values():
+    np = pytest.importorskip('numpy')
+    pytest.importorskip('pandas')
+
+    assert from_parquet(np.array(['Stage', 'Live Band'], dtype=object)) == ['Stage', 'Live Band']
+    assert from_parquet(np.int64(3)) == 3 and type(from_parquet(np.int64(3))) is int
+    assert from_parquet(float('nan')) is None
+    assert from_parquet({'capacity': np.float64(8), 'tags': np.array([1, 2])}) == {'capacity': 8.0, 'tags': [1, 2]}
+    assert from_parquet(np.array([{'date': None, 'type': 'Live Music'}], dtype=object)) == \
+        [{'date': None, 'type': 'Live Music'}]
+    assert from_parquet('Casual') == 'Casual'
+
+
+def test_parquet_source_scores_like_the_original_documents(tmp_path):
+    pd = pytest.importorskip('pandas')
+    pytest.importorskip('pyarrow')
+
+    clubs = [
+        {'_id': str(ObjectId()), 'rating': 4.5, 'formatted_price': 3, 'features': ['Stage', 'Live Band'],
+         'genres': ['Jazz'], 'followers': ['a', 'b']},
+        {'_id': str(ObjectId()), 'rating': None, 'formatted_price': None, 'features': [], 'genres': ['Pop'],
+         'followers': []},
+    ]
+    path = tmp_path / 'clubs.parquet'
+    pd.DataFrame(clubs).to_parquet(path, index=False)
+
+    read = list(read_clubs(str(path)))
+    assert read[0]['features'] == ['Stage', 'Live Band']
+    assert 'rating' not in read[1]
+
+    writer = RecordingWriter()
+    stats = score_clubs.score_clubs(read, writer)
+    assert stats['failed'] == 0
+    manager = score_clubs.ClubScoreManager(db=None)
+    expected = manager.score_club({k: v for k, v in clubs[0].items() if v is not None})
+    assert writer.written[0] == (ObjectId(clubs[0]['_id']), expected)
+
+
+def test_score_clubs_counts_failures_and_converts_ids():
+    good = make_club(_id=str(ObjectId()))
+    bad = make_club(rating='not a number')
+    # Wrong-typed list fields are tolerated by ClubScorer
+    odd = make_club(features=None, reviews=object())
+    writer = RecordingWriter()
+    log = io.StringIO()
+
+    stats = score_clubs.score_clubs([good, bad, odd], writer, log=log)
+
+    assert stats['scored'] == 2
+    assert stats['failed'] == 1
+    assert writer.written[0][0] == ObjectId(good['_id'])
+    assert str(bad['_id']) in log.getvalue()
+    assert writer.closed and not writer.aborted
+
+
+def test_interrupted_run_aborts_writer():
+    def clubs():
+        yield make_club()
+        raise ConnectionError('cursor died')
+
+    writer = RecordingWriter()
+    with pytest.raises(ConnectionError):
+        score_clubs.score_clubs(clubs(), writer)
+    assert writer.aborted and not writer.closed
+    assert len(writer.written) == 1
+
+
+def test_mongo_writer_batches_upserts():
+    db = FakeDB()
+    writer = MongoScoreWriter(db, batch_size=2)
+    for _ in range(5):
+        writer.write(ObjectId(), {'trending': 1})
+    assert [len(batch) for batch in db.club_scores.batches] == [2, 2]
+
+    writer.abort()
+    assert [len(batch) for batch in db.club_scores.batches] == [2, 2, 1]
+
+
+def test_jsonl_writer_only_publishes_on_success(tmp_path):
+    path = str(tmp_path / 'scores.jsonl')
+    oid = ObjectId()
+
+    writer = JsonlScoreWriter(path)
+    writer.write(oid, {'trending': 10})
+    assert not os.path.exists(path)
+    writer.close()
+
+    record = json_util.loads(open(path).read())
+    assert record['club_id'] == oid
+    assert record['scores'] == {'trending': 10}
+    assert not os.path.exists(path + '.partial')
+
+    aborted = JsonlScoreWriter(str(tmp_path / 'aborted.jsonl'))
+    aborted.write(oid, {'trending': 10})
+    aborted.abort()
+    assert os.listdir(tmp_path) == ['scores.jsonl']
+
+
+def test_parquet_writer_streams_row_groups_and_only_publishes_on_success(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = str(tmp_path / 'scores.parquet')
+
+    writer = ParquetScoreWriter(path, batch_size=2)
+    ids = [ObjectId() for _ in range(5)]
+    for i, club_id in enumerate(ids):
+        writer.write(club_id, {'trending': i, 'luxury': 2 * i})
+    assert writer.writer is not None
+    assert not os.path.exists(path)
+    writer.close()
+
+    parquet = pq.ParquetFile(path)
+    assert parquet.num_row_groups == 3
+    rows = parquet.read().to_pylist()
+    assert [row['club_id'] for row in rows] == [str(i) for i in ids]
+    assert rows[4]['scores'] == {'trending': 4, 'luxury': 8}
+
+    aborted = ParquetScoreWriter(str(tmp_path / 'aborted.parquet'), batch_size=2)
+    for club_id in ids:
+        aborted.write(club_id, {'trending': 1, 'luxury': 1})
+    aborted.abort()
+    assert os.listdir(tmp_path) == ['scores.parquet']
+
+
+def test_main_reports_failures_in_exit_code(tmp_path, capsys):
+    pytest.importorskip('dotenv')
+    source = tmp_path / 'clubs.jsonl'
+    output = tmp_path / 'scores.jsonl'
+    source.write_text(json_util.dumps(make_club()) + '\n')
+
+    assert score_clubs.main(['--source', str(source), '--output', str(output)]) == 0
+    assert 'scored 1 clubs, failed 0' in capsys.readouterr().err
+
+    source.write_text(json_util.dumps(make_club(rating='x')) + '\n')
+    assert score_clubs.main(['--source', str(source), '--output', str(output)]) == 1
+
+
+def test_main_writes_to_mongo_from_its_shard_only():
+    pytest.importorskip('dotenv')
+    clubs = [make_club() for _ in range(40)]
+    db = FakeDB(clubs)
+
+    assert score_clubs.main(['--shard', '1/3', '--batch-size', '5'], db=db) == 0
+
+    written = sum(len(batch) for batch in db.club_scores.batches)
+    assert written == sum(in_shard(c['_id'], (1, 3)) for c in clubs)